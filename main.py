@@ -1,15 +1,68 @@
 import os
+import shutil
+import sys
 import logging
 import argparse
+import io
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from collections import OrderedDict
+from itertools import groupby, islice
+from operator import itemgetter
 from datetime import datetime
 
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
+from urllib3.util.retry import Retry
 from pypdf import PdfReader, PdfWriter
+try:
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
 
 # Load environment variables
 load_dotenv()
+API_TOKEN = os.getenv('API_TOKEN')
+API_BASE_URL = os.getenv('API_BASE_URL')
+POST_ENDPOINT = f"{API_BASE_URL}post_document/"
+AUTH_HEADERS = {'Authorization': f"Token {API_TOKEN}"}
+
+# Shared HTTP session so uploads reuse pooled keep-alive connections
+SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.3))
+SESSION.mount('https://', _ADAPTER)
+SESSION.mount('http://', _ADAPTER)
+
+class ReaderCache:
+    """Small LRU of parsed PdfReaders keyed on path.
+
+    Cache hits cost no syscall, the file is only read on a miss. Call clear()
+    once the files may have changed. PdfReader(path) reads the whole file into
+    memory and closes it, so readers inherited by forked pool workers never
+    share a file handle or offset.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._readers = OrderedDict()
+
+    def get(self, pdf_path):
+        reader = self._readers.get(pdf_path)
+        if reader is not None:
+            self._readers.move_to_end(pdf_path)
+            return reader
+        reader = PdfReader(pdf_path)
+        self._readers[pdf_path] = reader
+        while len(self._readers) > self.maxsize:
+            self._readers.popitem(last=False)
+        return reader
+
+    def clear(self):
+        self._readers.clear()
+
+# Per-process cache, pool workers each keep their own
+READERS = ReaderCache()
 
 def setup_logging(verbose):
     if verbose:
@@ -26,135 +79,240 @@ def validate_path(path):
     try:
         if not os.path.exists(path):
             os.makedirs(path)
-            logging.info(f"Created directory: {path}")
+            logging.info("Created directory: %s", path)
         return True
     except Exception as e:
-        logging.error(f"Error creating directory {path}: {str(e)}")
+        logging.error("Error creating directory %s: %s", path, e)
         return False
 
 def clean_output(path):
     try:
-        files = [f.name for f in os.scandir(path) if f.is_file()]
-        files_len = len(files)
-        if files_len != 0:
-            print(f"Removing existing output files. ({files_len} to be removed)")
-            for file in files:
+        count = 0
+        with os.scandir(path) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
                 try:
-                    os.remove(os.path.join(path, file))
-                    logging.info(f"{file} removed successfully.")
-                except Exception as e:
-                    logging.warning(f"Error deleting {file}: {e}")
+                    os.unlink(entry.path)
+                    count += 1
+                    logging.info("%s removed successfully.", entry.name)
+                except OSError as e:
+                    logging.warning("Error deleting %s: %s", entry.name, e)
+        if count != 0:
+            print(f"Removed existing output files. ({count} removed)")
     except Exception as outer_error:
-        logging.error(f"Error accessing directory {path}: {outer_error}")
+        logging.error("Error accessing directory %s: %s", path, outer_error)
 
-def split_pdf(pdf_path, output_folder):
-    output_dir = os.path.join(output_folder)
-    if not validate_path(output_dir):
-        return False
+def render_page(page):
+    # Serialise into memory first, the buffered file then writes it out in one pass
+    pdf_writer = PdfWriter()
+    pdf_writer.add_page(page)
+    buffer = io.BytesIO()
+    pdf_writer.write(buffer)
+    return buffer
+
+def write_page(page, page_num, output_path):
     try:
-        if not os.path.exists(pdf_path):
-            logging.error(f"PDF file not found: {pdf_path}")
-            return False
-        pdf = PdfReader(pdf_path)
-        if len(pdf.pages) == 0:
-            logging.error(f"PDF file is empty: {pdf_path}")
-            return False
-        for page_num in range(len(pdf.pages)):
-            try:
-                pdf_writer = PdfWriter()
-                pdf_writer.add_page(pdf.pages[page_num])
-                output_filename = f"temp_page_{page_num + 1}.pdf"
-                output_path = os.path.join(output_dir, output_filename)
-                with open(output_path, 'wb') as output_file:
-                    pdf_writer.write(output_file)
-                logging.debug(f"Created page {page_num + 1}")
-            except Exception as e:
-                logging.error(f"Error processing page {page_num + 1}: {str(e)}")
-        logging.info(f"Successfully split {pdf_path} into {len(pdf.pages)} pages")
-        return True
+        buffer = render_page(page)
+        with open(output_path, 'wb') as output_file:
+            output_file.write(buffer.getbuffer())
+        return True, page_num, output_path
     except Exception as e:
-        logging.error(f"Error processing PDF {pdf_path}: {str(e)}")
-        return False
+        return False, page_num, str(e)
 
-def rename_files(output_dir, start_index=1):
+def _write_page(args):
+    pdf_path, page_num, output_path = args
     try:
-        files = [f for f in os.listdir(output_dir) if f.endswith('.pdf')]
-        if not files:
-            logging.warning(f"No PDF files found in {output_dir}")
-            return False, start_index
-        creation_date = datetime.now().strftime("%d-%m-%y %Hh%Mm")
-        for filename in sorted(files):
-            try:
-                old_path = os.path.join(output_dir, filename)
-                new_name = f"{start_index:02}_Xerox_Scan_{creation_date}.pdf"
-                new_path = os.path.join(output_dir, new_name)
-                os.rename(old_path, new_path)
-                logging.debug(f"Renamed: {filename} -> {new_name}")
-                start_index += 1
-            except Exception as e:
-                logging.error(f"Error renaming {filename}: {str(e)}")
-        logging.info(f"Successfully renamed {len(files)} files")
-        return True, start_index
+        pdf = READERS.get(pdf_path)
+    except Exception as e:
+        return False, page_num, str(e)
+    return write_page(pdf.pages[page_num], page_num, output_path)
+
+def output_name(index, creation_date):
+    return f"{index:02}_Xerox_Scan_{creation_date}.pdf"
+
+def split_workers():
+    workers = os.cpu_count() or 1
+    try:
+        cap = int(os.getenv('SPLIT_WORKERS', workers))
+    except ValueError:
+        logging.warning("Invalid SPLIT_WORKERS value, using %s", workers)
+        return workers
+    return max(1, min(workers, cap))
+
+def upload_workers():
+    workers = 6
+    try:
+        workers = int(os.getenv('UPLOAD_WORKERS', workers))
+    except ValueError:
+        logging.warning("Invalid UPLOAD_WORKERS value, using %s", workers)
+    return max(1, workers)
+
+def split_tasks(pdf_path, output_folder, start_index, creation_date):
+    # Joined once, the per-page paths below are plain string concatenation
+    prefix = os.path.join(output_folder, '')
+    try:
+        try:
+            page_count = len(READERS.get(pdf_path).pages)
+        except FileNotFoundError:
+            logging.error("PDF file not found: %s", pdf_path)
+            return False, []
+        if page_count == 0:
+            logging.error("PDF file is empty: %s", pdf_path)
+            return False, []
+        return True, [(pdf_path, page_num, f"{prefix}{output_name(start_index + page_num, creation_date)}")
+                      for page_num in range(page_count)]
     except Exception as e:
-        logging.error(f"Error during renaming process: {str(e)}")
-        return False, start_index
+        logging.error("Error processing PDF %s: %s", pdf_path, e)
+        return False, []
+
+def split_pages(tasks):
+    """Write each task's page, yielding (success, page_num, detail) as pages finish.
+
+    At most two renders per worker are queued at a time, so a large scan is
+    never held in the pool all at once.
+    """
+    workers = min(split_workers(), len(tasks))
+    if workers > 1:
+        results = _pooled_pages(tasks, workers)
+    else:
+        results = _sequential_pages(tasks)
+    try:
+        for success, page_num, detail in results:
+            if success:
+                logging.debug("Created page %d: %s", page_num + 1, os.path.basename(detail))
+            else:
+                logging.error("Error processing page %d: %s", page_num + 1, detail)
+            yield success, page_num, detail
+    finally:
+        results.close()
+
+def _sequential_pages(tasks):
+    # Single worker: reuse the cached readers instead of spawning a pool,
+    # resolving each PDF's pages once rather than once per task
+    for pdf_path, pdf_tasks in groupby(tasks, key=itemgetter(0)):
+        pages = READERS.get(pdf_path).pages
+        for _, page_num, output_path in pdf_tasks:
+            yield write_page(pages[page_num], page_num, output_path)
+
+def _pooled_pages(tasks, workers):
+    tasks = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_write_page, task) for task in islice(tasks, workers * 2)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = next(tasks, None)
+                    if task is not None:
+                        pending.add(executor.submit(_write_page, task))
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
 
 def test_api_connection():
     try:
-        if not api_url or not api_token:
+        if not API_BASE_URL or not API_TOKEN:
             raise ValueError("API_BASE_URL and API_TOKEN must be set in environment variables")
-        headers = {'Authorization': f"Token {api_token}"}
-        response = requests.get(api_url, headers=headers, verify=pubkey)
+        response = SESSION.get(API_BASE_URL, headers=AUTH_HEADERS, verify=SESSION.verify)
         if response.status_code == 200:
             print("API Connection successful!")
             return True
         else:
-            logging.error(f"API Connection failed with status code: {response.status_code}")
-            logging.error(f"API Response: {response.text}")
+            logging.error("API Connection failed with status code: %s", response.status_code)
+            logging.error("API Response: %s", response.text)
             return False
     except RequestException as e:
-        logging.error(f"Network error while testing API: {str(e)}")
+        logging.error("Network error while testing API: %s", e)
+        return False
+    except Exception as e:
+        logging.error("Error testing API connection: %s", e)
+        return False
+
+def _post_document(path):
+    file = os.path.basename(path)
+    with open(path, 'rb') as file_data:
+        post = {'document': (file, file_data, 'application/pdf')}
+        if MultipartEncoder is not None:
+            # Stream the multipart body from disk instead of building it in memory
+            encoder = MultipartEncoder(fields=post)
+            headers = {**AUTH_HEADERS, 'Content-Type': encoder.content_type, 'Content-Length': str(encoder.len)}
+            response = SESSION.post(POST_ENDPOINT, headers=headers, data=encoder, verify=SESSION.verify)
+        else:
+            response = SESSION.post(POST_ENDPOINT, headers=AUTH_HEADERS, files=post, verify=SESSION.verify)
+    response.raise_for_status()
+    return file, response.content
+
+def upload(pdf_files, preflight=False):
+    """Split pages into the output folder and upload them as they are written.
+
+    Splitting and uploading overlap, and only a few renders are in flight at a
+    time. Auth or URL problems surface from the first POST, which cancels all
+    pending work. The API check only runs beforehand when preflight is set.
+    """
+    if not API_BASE_URL or not API_TOKEN:
+        logging.error("API_BASE_URL and API_TOKEN must be set in environment variables")
+        return False
+    if preflight and not test_api_connection():
+        return False
+    tasks, split_files = plan_pages(pdf_files)
+    total = len(tasks)
+    print(f"\nThere are {total} files to be uploaded")
+    uploaded = 0
+
+    def report(future):
+        nonlocal uploaded
+        file, content = future.result()
+        uploaded += 1
+        print(f"{uploaded:02}/{total:02} Uploaded {file}")
+        logging.info("Successfully uploaded %s. Response: %s", file, content)
+
+    try:
+        with ThreadPoolExecutor(max_workers=upload_workers()) as uploader:
+            uploads = set()
+            pages = split_pages(tasks)
+            try:
+                # Uploads are checked as they finish so the first failed POST stops the run
+                for success, _, output_path in pages:
+                    if success:
+                        uploads.add(uploader.submit(_post_document, output_path))
+                    done = {future for future in uploads if future.done()}
+                    uploads -= done
+                    for future in done:
+                        report(future)
+                while uploads:
+                    done, uploads = wait(uploads, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(future)
+            except Exception:
+                pages.close()
+                for future in uploads:
+                    future.cancel()
+                raise
+        report_split(split_files, len(pdf_files))
+        return True
+    except RequestException as e:
+        logging.error("Network error during file upload: %s", e)
         return False
     except Exception as e:
-        logging.error(f"Error testing API connection: {str(e)}")
+        logging.error("Error during file upload: %s", e)
         return False
 
-def upload():
-    if test_api_connection():
-        headers = {'Authorization': f"Token {os.getenv('API_TOKEN')}"}
-        POST_endpoint = f"{os.getenv('API_BASE_URL')}post_document/"
-        files = [f for f in os.listdir(output_folder) if os.path.isfile(os.path.join(output_folder, f))]
-        total = len(files)
-        print(f"\nThere are {total} files to be uploaded")
+def clean_consume(content):
+    # Creation times are read once, the list is updated in place after each deletion
+    listing = []
+    for entry in content:
         try:
-            for i, file in enumerate(files, 1):
-                if os.path.isfile(os.path.join(output_folder, file)):
-                    print(f"{i:02}/{total:02} Uploading {file}")
-                    with open(os.path.join(output_folder, file), 'rb') as file_data:
-                        post = {'document': (file, file_data)}
-                        response = requests.post(POST_endpoint, headers=headers, files=post, verify=pubkey)
-                        response.raise_for_status()
-                        logging.info(f"Successfully uploaded {file}. Response: {response.content}")
-            return True
-        except RequestException as e:
-            logging.error(f"Network error during file upload: {str(e)}")
-            return False
+            created_time = datetime.fromtimestamp(entry.stat().st_ctime)
         except Exception as e:
-            logging.error(f"Error during file upload: {str(e)}")
-            return False
-            
-def clean_consume():
-    content = os.listdir(consume_folder)
+            created_time = f"Error: {e}"
+        listing.append((entry, created_time))
 
-    while len(content) > 1:
+    while len(listing) > 1:
         print("\nFiles in consume folder:")
-        for n in range(len(content)):
-            fullpath = os.path.join(consume_folder, content[n])
-            try:
-                created_time = datetime.fromtimestamp(os.path.getctime(fullpath))
-            except Exception as e:
-                created_time = f"Error: {e}"
-            print(f"[{n+1}] {content[n]}        Created: {created_time}")
+        for n, (entry, created_time) in enumerate(listing):
+            print(f"[{n+1}] {entry.name}        Created: {created_time}")
 
         try:
             index = int(input("Select which file to delete (0 to skip deleting): "))
@@ -164,36 +322,92 @@ def clean_consume():
 
         if index == 0:
             print("Skipping...")
-            return True
+            break
 
         # Validate index within allowed range
-        while index < 1 or index > len(content):
+        while index != 0 and not 1 <= index <= len(listing):
             try:
                 index = int(input("Invalid index, please select a valid one (0 to skip): "))
             except ValueError:
                 print("Invalid input, skipping...")
-                return True
+                return [entry for entry, _ in listing]
+        if index == 0:
+            print("Skipping...")
+            break
 
-        fullpath = os.path.join(consume_folder, content[index - 1])
+        entry = listing[index - 1][0]
         try:
-            os.remove(fullpath)
-            print(f"Deleted {content[index - 1]}")
+            os.remove(entry.path)
+            print(f"Deleted {entry.name}")
+            del listing[index - 1]
         except FileNotFoundError:
             print("File not found, it may have been moved or deleted already.")
+            del listing[index - 1]
         except PermissionError:
             print("Permission denied: Could not delete the file.")
         except Exception as e:
             print(f"Unexpected error: {e}")
 
-        content = os.listdir(consume_folder)
+    return [entry for entry, _ in listing]
+
+def plan_pages(pdf_files):
+    """Build the split tasks for every PDF.
+
+    Starting indexes are assigned up front from the page counts, so the pages
+    of all PDFs are split by one pool into disjoint ranges of output names.
+    """
+    rename_counter = 1
+    creation_date = datetime.now().strftime("%d-%m-%y %Hh%Mm")
+    tasks = []
+    split_files = []
+    for index, (filename, pdf_path) in enumerate(pdf_files, 1):
+        print(f"\nProcessing file {index}/{len(pdf_files)}: {filename}")
+        success, pdf_tasks = split_tasks(pdf_path, output_folder, rename_counter, creation_date)
+        if not success:
+            logging.error("Failed to process %s", filename)
+            continue
+        tasks.extend(pdf_tasks)
+        rename_counter += len(pdf_tasks)
+        split_files.append((pdf_path, len(pdf_tasks)))
+    return tasks, split_files
+
+def report_split(split_files, total):
+    for pdf_path, page_count in split_files:
+        logging.info("Successfully split %s into %d pages", pdf_path, page_count)
+    print(f"\nCompleted processing {total} PDF files")
+
+def process(pdf_files):
+    tasks, split_files = plan_pages(pdf_files)
+    for _ in split_pages(tasks):
+        pass
+    report_split(split_files, len(pdf_files))
+
+def archive(entries):
+    if not validate_path(archive_folder):
+        return False
+    # os.replace only works within one filesystem, fall back to shutil.move across devices
+    same_device = os.stat(consume_folder).st_dev == os.stat(archive_folder).st_dev
+    move = os.replace if same_device else shutil.move
+    prefix = os.path.join(archive_folder, '')
+    for entry in entries:
+        try:
+            move(entry.path, f"{prefix}{entry.name}")
+            logging.debug("Archived %s", entry.name)
+        except Exception as e:
+            logging.error("Error archiving %s: %s", entry.name, e)
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description='PDF Splitter and Renamer')
     parser.add_argument('-verbose', action='store_true', help='Enable detailed logging')
     parser.add_argument('-testAPI', action='store_true', help='Test API connectivity')
     parser.add_argument('-upload', action='store_true', help="Upload to Paperless-NGX instance")
+    parser.add_argument('-preflight', action='store_true', help="Test API connectivity before uploading")
     parser.add_argument('-archive', action='store_true', help="Archive processed files")
+    parser.add_argument('-nonInteractive', action='store_true', help="Process every file in the consume folder without prompting")
     args = parser.parse_args()
+    if not sys.stdin.isatty():
+        args.nonInteractive = True
 
     global script_dir
     global consume_folder
@@ -204,12 +418,10 @@ def main():
     output_folder = os.path.join(script_dir, os.getenv('OUTPUT_FOLDER')) or input("Enter the path for the output directory: ").strip()
     archive_folder = os.path.join(script_dir, "Archive") or input("Enter the path for the archive directory: ").strip()
 
-    global api_url
-    api_url = os.getenv('API_BASE_URL')
-    global api_token
-    api_token = os.getenv('API_TOKEN')
     global pubkey
     pubkey = os.path.join(script_dir, os.getenv('PUBKEY')) or input("Enter the path for the TLS CA certificate (.pem file): ").strip()
+    # Also passed on every call, requests lets REQUESTS_CA_BUNDLE override the session default
+    SESSION.verify = pubkey
 
     setup_logging(args.verbose)
 
@@ -227,41 +439,34 @@ def main():
             return
         clean_output(output_folder)
 
-        if len(os.listdir(consume_folder)) > 1 :
-            clean_consume()
+        with os.scandir(consume_folder) as it:
+            consume_entries = list(it)
+        if len(consume_entries) > 1 and not args.nonInteractive:
+            consume_entries = clean_consume(consume_entries)
         
-        pdf_files = [f for f in os.listdir(consume_folder) if f.lower().endswith('.pdf')]
+        pdf_files = [(f.name, f.path) for f in consume_entries if f.is_file() and f.name.lower().endswith('.pdf')]
         if not pdf_files:
             logging.warning("No PDF files found in the consume_folder folder")
             return
 
-        rename_counter = 1
-        for index, filename in enumerate(pdf_files, 1):
-            print(f"\nProcessing file {index}/{len(pdf_files)}: {filename}")
-            pdf_path = os.path.join(consume_folder, filename)
-            if split_pdf(pdf_path, output_folder):
-                success, rename_counter = rename_files(output_folder, rename_counter)
-                if not success:
-                    logging.error(f"Failed to rename files for {filename}")
+        if args.upload:
+            if upload(pdf_files, args.preflight):
+                print(f"{len(pdf_files):02} files processed and uploaded")
+                os.startfile(output_folder)
             else:
-                logging.error(f"Failed to process {filename}")
-
-        print(f"\nCompleted processing {len(pdf_files)} PDF files")
+                exit(1)
+        else:
+            process(pdf_files)
 
     except Exception as e:
-        logging.error(f"Program error: {str(e)}")
+        logging.error("Program error: %s", e)
         raise
 
-    if args.upload:
-        if upload():
-            print(f"{len(pdf_files):02} files processed and uploaded")
-            os.startfile(output_folder)
-        else:
-            exit(1)
+    # Free the cached PDFs before archiving
+    READERS.clear()
 
     if args.archive:
-        for filename in os.listdir(consume_folder):
-            os.rename(os.path.join(consume_folder, filename), os.path.join(archive_folder, filename))
+        archive(consume_entries)
 
 
 if __name__ == "__main__":